@@ -1,13 +1,39 @@
+import socket
 import requests
 import logging
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
 
 
 log = logging.getLogger(__name__)
 
+# Probe idle connections so a dropped one is noticed before the next post, TCP_KEEPIDLE only exists on Linux
+SOCKET_OPTIONS = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+if hasattr(socket, "TCP_KEEPIDLE"):
+    SOCKET_OPTIONS.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30))
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter that enables TCP keep-alive on its pooled connections."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = HTTPConnection.default_socket_options + SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
+
+
+# One pooled connection, reused across posts so each interval skips the TCP and TLS handshake.
+# Only failed connects are retried, a post that reached the server is never sent twice.
+session = requests.Session()
+adapter = KeepAliveAdapter(pool_connections=1, pool_maxsize=1,
+                           max_retries=Retry(total=2, connect=2, read=0, backoff_factor=0.2))
+session.mount("http://", adapter)
+session.mount("https://", adapter)
+
 
 def post_api(url, device, total: int, total_down: int, total_up: int, delta: int):
     log.info(f"API - total: {total}, total_down: {total_down}, total_up: {total_up}, delta: {delta} ")
     post_body = {'apparaat': device, 'binnen': total_down, 'buiten': total_up, 'delta': delta, 'totaal': total}
-    resp = requests.post(url, json=post_body)
+    resp = session.post(url, json=post_body)
     log.info(resp.text)
     return resp
@@ -11,6 +11,7 @@ class Config:
     device: str = "default"
     stream_url: str = ""
     coords_left_line: int = 640
+    show_window: bool = True
 
 
 def get_config(config_type: int = 0):
@@ -1,15 +1,20 @@
 import cv2
+import numpy as np
+
+from tracking.centroid_tracker import SCORE_MAX
 
 
 def draw_boxes_model(frame, detections, classes, target_classes):
     """Draw bounding boxes on the frame."""
-    for det in detections:
-        x1, y1, x2, y2, conf, cls_id = det
-        if int(cls_id) in target_classes:
-            # label = f"{classes[int(cls_id)]} {conf:.2f}"
-            color = (255, 255, 255)  # Green color for bounding box
-            cv2.rectangle(frame, (int(x1)-5, int(y1)-5), (int(x2)-5, int(y2)-5), color, 2)
-            # cv2.putText(frame, label, (int(x1), int(y1) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+    detections = np.asarray(detections).reshape(-1, 6)
+    # Select the target classes in one pass, then only loop over the boxes that are drawn
+    mask = np.isin(detections[:, 5].astype(np.int32), np.asarray(target_classes, dtype=np.int32))
+    boxes = detections[mask, :4].astype(np.int32) - 5
+    for x1, y1, x2, y2 in boxes.tolist():
+        # label = f"{classes[int(cls_id)]} {conf:.2f}"
+        color = (255, 255, 255)  # Green color for bounding box
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        # cv2.putText(frame, label, (int(x1), int(y1) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
     return frame
 
 
@@ -48,9 +53,9 @@ def draw_correlations(frame, correlations, tracked_persons, tracked_umbrellas):
         person_data = tracked_persons[person_id]
         umbrella_data = tracked_umbrellas[umbrella_id]
         cv2.line(frame, person_data["centroid"], umbrella_data["centroid"], color, 2)
-        cv2.putText(frame, "{:.2f}".format(person_score), person_data["centroid"],
+        cv2.putText(frame, "{:.2f}".format(person_score / SCORE_MAX), person_data["centroid"],
                     cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-        cv2.putText(frame, "{:.2f}".format(umbrella_score), umbrella_data["centroid"],
+        cv2.putText(frame, "{:.2f}".format(umbrella_score / SCORE_MAX), umbrella_data["centroid"],
                     cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
     return frame
 
@@ -1,51 +1,89 @@
-import cv2, threading, queue
+import cv2, threading
+import logging
+import os
 import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+# pull RTSP over TCP instead of UDP, avoids smeared frames from dropped packets
+# and skip FFmpeg's input buffering and frame reordering delay, the stream is consumed live
+os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "rtsp_transport;tcp|fflags;nobuffer|flags;low_delay")
+
+# open parameters for the FFmpeg backend, timeouts only take effect when passed at open time
+CAPTURE_PARAMS = [
+    cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, 60000,
+    cv2.CAP_PROP_READ_TIMEOUT_MSEC, 60000,
+    cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY,
+]
 
 
 class ThreadingClass:
     # initiate threading class
     def __init__(self, name):
-        self.cap = cv2.VideoCapture(name)
         self.stream_url = name
-        self.cap.set(cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, 60000)
-        self.cap.set(cv2.CAP_PROP_READ_TIMEOUT_MSEC, 60000)
-        # define an empty queue and thread
-        self.q = queue.Queue()
+        self.cap = self._open_capture()
+        # define a single frame slot, its condition and the thread
+        self.frames = deque(maxlen=1)
+        self.ready = threading.Condition()
+        # set by the reader when it gives up on the stream
+        self.closed = False
         t = threading.Thread(target=self._reader)
         t.daemon = True
         t.start()
 
+    # open the stream with FFmpeg and hardware decoding when available, else the default backend
+    def _open_capture(self):
+        cap = cv2.VideoCapture(self.stream_url, cv2.CAP_FFMPEG, CAPTURE_PARAMS)
+        if not cap.isOpened():
+            cap = cv2.VideoCapture(self.stream_url)
+            cap.set(cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, 60000)
+            cap.set(cv2.CAP_PROP_READ_TIMEOUT_MSEC, 60000)
+        # keep at most one frame in the backend buffer, ignored by backends without one
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
     # read the frames as soon as they are available
     # this approach removes OpenCV's internal buffer and reduces the frame lag
     def _reader(self):
         retry_count = 0
         retry_delay = 5
         max_retries = 5
+        # bind the per-frame lookups to locals, the capture is rebound after a reconnect
+        frames, ready = self.frames, self.ready
+        read = self.cap.read
         while True:
-            ret, frame = self.cap.read()  # read the frames and ---
+            ret, frame = read()  # read the frames and ---
             if not ret:
-                print("Error: Stream timeout or frame read error.")
+                log.error("Stream timeout or frame read error.")
                 retry_count += 1
                 if retry_count > max_retries:
-                    print("Error: Maximum retry limit reached. Exiting.")
+                    log.error("Maximum retry limit reached. Exiting.")
+                    # wake up any read() so the consumer sees the stream is gone
+                    with ready:
+                        self.closed = True
+                        ready.notify_all()
                     break
                 else:
-                    print(f"Retrying in {retry_delay} seconds... ({retry_count}/{max_retries})")
+                    log.warning("Retrying in %s seconds... (%s/%s)", retry_delay, retry_count, max_retries)
                     time.sleep(retry_delay)
                     self.cap.release()
-                    self.cap = cv2.VideoCapture(self.stream_url)
+                    self.cap = self._open_capture()
+                    read = self.cap.read
                     continue
             else:
                 retry_count = 0
-            if not self.q.empty():
-                try:
-                    self.q.get_nowait()
-                except queue.Empty:
-                    pass
-            self.q.put(frame)  # --- store them in a queue (instead of the buffer)
-
-    def read(self):
-        return self.q.get()  # fetch frames from the queue one by one
+            with ready:
+                frames.append(frame)  # --- replace the frame in the slot, the consumer always gets the latest one
+                ready.notify()
+
+    # wait for the latest frame and take it out of the slot
+    # returns None after the timeout or when the stream is closed, so the caller can check its stop condition
+    def read(self, timeout=None):
+        with self.ready:
+            if not self.ready.wait_for(lambda: self.frames or self.closed, timeout) or not self.frames:
+                return None
+            return self.frames.popleft()
 
     def release(self):
         return self.cap.release()  # release the hw resource
@@ -1,30 +1,36 @@
 from typing import Tuple
+import math
+from scipy.optimize import linear_sum_assignment
 import numpy as np
 
 
-def get_matching_indices(distance_matrix):
+# Cost of a pair beyond the maximum distance, higher than any total of allowed pairs
+GATED_COST = 1e9
+
+
+def get_matching_indices(distance_matrix, max_distance=None):
     """
-    Get sorted row and column indices based on distance matrix.
+    Get one-to-one row and column indices with the minimal total distance.
 
     :param distance_matrix: Distance matrix between object centroids and input centroids.
+    :param max_distance: Pairs further apart get GATED_COST, so they never displace a pair within the distance.
     :return: Tuple of row indices and column indices.
     """
-    rows = distance_matrix.min(axis=1).argsort()
-    columns = distance_matrix.argmin(axis=1)[rows]
-    return rows, columns
+    if max_distance is not None:
+        distance_matrix = np.where(distance_matrix > max_distance, GATED_COST, distance_matrix)
+    return linear_sum_assignment(distance_matrix)
 
 
 def compute_centroids(rects):
     """
     Compute centroids from bounding box coordinates.
 
-    :param rects: List of bounding boxes as (x1, y1, x2, y2).
+    :param rects: List or array of bounding boxes as (x1, y1, x2, y2).
     :return: Numpy array of centroids.
     """
-    centroids = np.zeros((len(rects), 2), dtype="int")
-    for i, (start_x, start_y, end_x, end_y) in enumerate(rects):
-        centroids[i] = (int((start_x + end_x) / 2.0), int((start_y + end_y) / 2.0))
-    return centroids
+    rects = np.asarray(rects).reshape(-1, 4)
+    # Midpoints of (x1, y1) and (x2, y2) for all boxes at once, truncated like int()
+    return ((rects[:, :2] + rects[:, 2:]) / 2.0).astype("int")
 
 
 def angle_from_vertical(p1: Tuple[int, int], p2: Tuple[int, int]) -> float:
@@ -35,7 +41,7 @@ def angle_from_vertical(p1: Tuple[int, int], p2: Tuple[int, int]) -> float:
     :param p2: The ending point of the line (umbrella centroid).
     :return: The absolute angle in degrees between the line and the vertical line.
     """
-    dx, dy = np.array(p2) - np.array(p1)
-    angle = np.arctan2(dx, dy) * (180 / np.pi)  # Angle in degrees
-    angle = 180 - np.abs(angle)  # Ensure angle is positive
-    return angle
+    dx = p2[0] - p1[0]
+    dy = p2[1] - p1[1]
+    angle = math.degrees(math.atan2(dx, dy))  # Angle in degrees
+    return 180.0 - abs(angle)  # Ensure angle is positive
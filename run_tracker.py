@@ -4,24 +4,39 @@ from concurrent.futures import ThreadPoolExecutor
 import torch
 import cv2
 import logging
+import signal
+import threading
 import time
 
 from config.config import get_config
 from drawing.frame_drawer import draw_on_frame
 from helpers.thread import ThreadingClass
 from tracking.centroid_tracker import CentroidTracker
-from tracking.tracker import filter_detections, handle_tracked_objects
+from tracking.tracker import split_detections, handle_tracked_objects
 from api.api import post_api
 
-logging.basicConfig(level=logging.INFO, format="[INFO] %(message)s")
+logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(asctime)s: %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 log = logging.getLogger(__name__)
 
+# inference_mode needs torch 1.9+, requirements allow 1.7 where no_grad is the closest equivalent
+inference_mode = getattr(torch, 'inference_mode', torch.no_grad)
+
+# Frames are resized to this (width, height) before inference, tracking and drawing
+FRAME_SIZE = (640, 360)
+
+# Seconds to wait for a frame before checking the stop flag again, keeps Ctrl-C responsive on a stalled stream
+READ_TIMEOUT = 0.5
+
 
 def load_model():
     """Load the YOLOv7 model with GPU support if available."""
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     log.info(f'cuda={torch.cuda.is_available()}: {device}')
-    return torch.hub.load('WongKinYiu/yolov7', 'custom', 'yolov7.pt', source='github').to(device), device
+    model = torch.hub.load('WongKinYiu/yolov7', 'custom', 'yolov7.pt', source='github').to(device)
+    if device.type == 'cuda':
+        # Half precision halves the memory traffic, the hub wrapper casts the input to the model dtype
+        model = model.half()
+    return model, device
 
 
 def parse_arguments():
@@ -37,9 +52,13 @@ def main():
     args = parse_arguments()
     config = get_config(args["input"])
 
-    api_time = time.time() if config.enable_api else None
+    # Keep OpenCV single threaded, its pool only competes with torch and the capture thread for the cores
+    cv2.setNumThreads(1)
 
-    width, height = None, None
+    # Monotonic deadline of the next API post, moved forward by one interval after each post
+    next_api_time = time.monotonic() + config.api_interval if config.enable_api else None
+
+    width, height = FRAME_SIZE
     total_frames = 1
     total_down = 0
     total_up = 0
@@ -55,62 +74,83 @@ def main():
     # Initialize CentroidTracker
     centroid_tracker = CentroidTracker(max_disappeared=50, max_distance=50)
 
-    # Loop over the frames from the video stream
-    while True:
-        frame = cap.read()
+    # Log the source resolution once, every frame is processed at FRAME_SIZE
+    frame = cap.read()
+    if frame is None:
+        log.error("Stream closed before the first frame.")
+        return
+    (source_height, source_width) = frame.shape[:2]
+    log.info(f'{source_height=}, {source_width=}')
+
+    # Single worker for the API posts, reused for every interval
+    api_executor = ThreadPoolExecutor(max_workers=1)
 
-        if width is None or height is None:
-            (height, width) = frame.shape[:2]
-            log.info(f'{height=}, {width=}')
-            width = 640
-            height = 360
+    # Ctrl-C finishes the current frame and leaves the loop, headless runs have no window to press 'q' in
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    # pollKey (OpenCV 4.5+) pumps the window events without waitKey's 1 ms sleep
+    poll_key = getattr(cv2, 'pollKey', None) or (lambda: cv2.waitKey(1))
+
+    # Loop over the frames from the video stream
+    while not stop.is_set():
+        frame = cap.read(timeout=READ_TIMEOUT)
+        if frame is None:
+            if cap.closed:
+                log.error("Stream closed, stopping.")
+                break
+            # the stream stalled, check the stop flag again
+            continue
 
         # Resize frame for faster processing
-        resized_frame = cv2.resize(frame, (640, 360))
+        resized_frame = cv2.resize(frame, FRAME_SIZE)
 
-        # Perform inference
-        results = model(resized_frame, size=640)  # Specify size for faster inference
+        # Perform inference, without autograd bookkeeping
+        with inference_mode():
+            results = model(resized_frame, size=640)  # Specify size for faster inference
 
         # Process results
         detections = results.xyxy[0].cpu().numpy()  # Move to CPU and convert to numpy array
 
-        # Class IDs: 0 for person, 25 for umbrella
-        person_detections = filter_detections(detections, target_class=0)
-        umbrella_detections = filter_detections(detections, target_class=25)
-
-        # Convert bounding boxes to centroids
-        person_centroids = [det[:4] for det in person_detections]
-        umbrella_centroids = [det[:4] for det in umbrella_detections]
+        # Class IDs: 0 for person, 25 for umbrella, as (N, 4) arrays of bounding boxes
+        person_boxes, umbrella_boxes = split_detections(detections, target_classes=(0, 25))
 
         # Update trackers
-        filtered_persons = centroid_tracker.update(person_centroids, obj_type="person")
-        filtered_umbrellas = centroid_tracker.update(umbrella_centroids, obj_type="umbrella")
+        filtered_persons = centroid_tracker.update(person_boxes, obj_type="person")
+        filtered_umbrellas = centroid_tracker.update(umbrella_boxes, obj_type="umbrella")
 
         correlations = centroid_tracker.correlate_objects(config.angle_offset, config.distance_offset)
 
         delta, total, total_down, total_up = handle_tracked_objects(delta, height, total, total_down, total_up,
                                                                     centroid_tracker.objects, config.coords_left_line)
 
-        info_status = [("Exit", total_up), ("Enter", total_down), ("Delta", delta)]
-        info_total = [("Total people inside", total)]
+        # Headless runs skip the drawing and the GUI event loop
+        if config.show_window:
+            info_status = [("Exit", total_up), ("Enter", total_down), ("Delta", delta)]
+            info_total = [("Total people inside", total)]
 
-        # Draw results on the frame
-        frame = draw_on_frame(resized_frame, filtered_persons, filtered_umbrellas, correlations,
-                              width, height, info_status, info_total, config.coords_left_line)
+            # Draw results on the frame
+            frame = draw_on_frame(resized_frame, filtered_persons, filtered_umbrellas, correlations,
+                                  width, height, info_status, info_total, config.coords_left_line)
 
-        if config.enable_api and (time.time() - api_time) > config.api_interval:
-            with ThreadPoolExecutor(max_workers=4) as executor:
-                # Submit tasks to the executor
-                executor.submit(post_api, config.api_url, config.device, total, total_down, total_up, delta)
+        if config.enable_api and (now := time.monotonic()) > next_api_time:
+            # Post in the background so the frame loop does not wait on the request
+            api_executor.submit(post_api, config.api_url, config.device, total, total_down, total_up, delta)
 
-            api_time = time.time()
+            next_api_time += config.api_interval
+            if next_api_time <= now:
+                # Skip the intervals missed during a stall instead of posting them back to back
+                next_api_time = now + config.api_interval
             delta = 0
 
         total_frames += 1
         # Show the output frame
-        cv2.imshow('AFF People Tracker', frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+        if config.show_window:
+            cv2.imshow('AFF People Tracker', frame)
+            if poll_key() & 0xFF == ord('q'):
+                break
+
+    api_executor.shutdown(wait=False)
 
 
 if __name__ == "__main__":
@@ -1,29 +1,55 @@
 from typing import List, Tuple
 from scipy.spatial import distance as dist
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict, deque
 import numpy as np
 import logging
 
 from helpers.utils import get_matching_indices, compute_centroids, angle_from_vertical
+from tracking.kernels import match_pairs
 
 log = logging.getLogger(__name__)
 
+# Correlation scores are quantized to uint8: 0 maps to 0.0 and SCORE_MAX to 1.0
+SCORE_MAX = 255
+SCORE_INCREMENT = 5  # ~0.02
+SCORE_DECREMENT = -13  # ~-0.05
 
-def update_score(obj_data, other_object_id, increment):
+# Number of recent centroids kept per object for the direction estimate
+CENTROID_HISTORY = 10
+
+# Up to this many person/umbrella pairs a direct scan is cheaper than the match kernel
+SMALL_PAIR_COUNT = 4
+
+
+def append_centroid(obj_data, centroid):
     """
-    Update the correlation score for a matched object.
+    Append a centroid to the history of an object and keep the running sum of its y coordinates.
+
+    :param obj_data: Data of the tracked object.
+    :param centroid: The new centroid of the object.
+    """
+    centroids = obj_data['centroids']
+    if len(centroids) == centroids.maxlen:
+        # The deque drops its oldest centroid on append
+        obj_data['y_sum'] -= int(centroids[0][1])
+    centroids.append(centroid)
+    obj_data['y_sum'] += int(centroid[1])
+
 
-    :param obj_data: Data of the object being updated (person or umbrella).
-    :param other_object_id: ID of the matched object (person or umbrella).
-    :param increment: Value to increment (or decrement) the score.
+def update_scores(person_correlations, umbrella_correlations, person_id, umbrella_id, increment):
     """
-    if other_object_id in obj_data['correlations']:
-        obj_data['correlations'][other_object_id] += increment
-    else:
-        obj_data['correlations'][other_object_id] = increment
+    Update the quantized correlation score of a person/umbrella pair in both directions.
 
-    # Ensure the score stays within a defined range, e.g., 0 to 1
-    obj_data['correlations'][other_object_id] = min(max(obj_data['correlations'][other_object_id], 0), 1)
+    :param person_correlations: Correlation scores of the person, keyed by umbrella ID.
+    :param umbrella_correlations: Correlation scores of the umbrella, keyed by person ID.
+    :param person_id: ID of the person.
+    :param umbrella_id: ID of the umbrella.
+    :param increment: Integer value to increment (or decrement) the scores.
+    """
+    # Both scores of a pair always receive the same updates, so clamp once to the uint8 range 0 to SCORE_MAX
+    score = min(max(person_correlations.get(umbrella_id, 0) + increment, 0), SCORE_MAX)
+    person_correlations[umbrella_id] = score
+    umbrella_correlations[person_id] = score
 
 
 class CentroidTracker:
@@ -39,20 +65,27 @@ class CentroidTracker:
         """
         self.next_object_id = 0
         self.objects = OrderedDict()
+        # Tracked objects per type in registration order, so filtering by type is a dict copy instead of a scan
+        self.objects_by_type = defaultdict(dict)
         self.disappeared = OrderedDict()
         self.max_disappeared = max_disappeared
         self.max_distance = max_distance
 
     def register(self, centroid, obj_type):
-        """Register a new object with a given centroid."""
-        self.objects[self.next_object_id] = {
-            'centroid': centroid, 'centroids': [centroid], 'type': obj_type, 'correlations': OrderedDict()
+        """Register a new object with a given centroid and return its ID."""
+        object_id = self.next_object_id
+        self.objects[object_id] = {
+            'centroid': centroid, 'centroids': deque([centroid], maxlen=CENTROID_HISTORY), 'y_sum': int(centroid[1]),
+            'type': obj_type, 'correlations': OrderedDict()
         }
-        self.disappeared[self.next_object_id] = 0
+        self.objects_by_type[obj_type][object_id] = self.objects[object_id]
+        self.disappeared[object_id] = 0
         self.next_object_id += 1
+        return object_id
 
     def deregister(self, object_id):
         """Deregister an object by its ID."""
+        del self.objects_by_type[self.objects[object_id]['type']][object_id]
         del self.objects[object_id]
         del self.disappeared[object_id]
 
@@ -61,23 +94,24 @@ class CentroidTracker:
         Update the tracking with the latest bounding box rectangles.
 
         :param obj_type: Type of objects to be tracked.
-        :param rects: List of bounding boxes as (x1, y1, x2, y2).
-        :return: Dictionary of object IDs and their centroids.
+        :param rects: List or array of bounding boxes as (x1, y1, x2, y2).
+        :return: Live view of the tracked objects of obj_type by ID, read only.
         """
-        if not rects:
+        # Kept in sync by register and deregister, so no copy is made per frame
+        filtered_objects = self.objects_by_type[obj_type]
+
+        if len(rects) == 0:
             self.handle_disappeared_objects()
-            return self.filter_by_type(obj_type)
+            return filtered_objects
 
         input_centroids = compute_centroids(rects)
 
-        filtered_objects = self.filter_by_type(obj_type)
-
         if not filtered_objects:
             self.initialize_objects(input_centroids, obj_type)
         else:
-            self.match_objects(input_centroids, obj_type)
+            self.match_objects(input_centroids, obj_type, filtered_objects)
 
-        return self.filter_by_type(obj_type)
+        return filtered_objects
 
     def handle_disappeared_objects(self):
         """Mark all tracked objects as disappeared and deregister if needed."""
@@ -91,34 +125,35 @@ class CentroidTracker:
         for centroid in input_centroids:
             self.register(centroid, obj_type)
 
-    def match_objects(self, input_centroids, obj_type):
+    def match_objects(self, input_centroids, obj_type, filtered_objects):
         """
         Match input centroids to existing objects and update or register them.
 
         :param obj_type: Type of objects to be tracked.
         :param input_centroids: Numpy array of centroids from the current frame.
+        :param filtered_objects: Tracked objects of obj_type.
         """
-        filtered_objects = self.filter_by_type(obj_type)
         object_ids = list(filtered_objects.keys())
-        object_centroids = [data['centroid'] for data in filtered_objects.values()]
-        distance_matrix = dist.cdist(np.array(object_centroids), input_centroids)
+        # cdist works in float64, so build the stacks in that dtype instead of letting it upcast int copies
+        object_centroids = np.asarray([data['centroid'] for data in filtered_objects.values()], dtype=np.float64)
+        distance_matrix = dist.cdist(object_centroids, np.asarray(input_centroids, dtype=np.float64))
 
-        rows, cols = get_matching_indices(distance_matrix)
-        used_rows, used_cols = set(), set()
+        # Matches are one-to-one, so no row or column is used twice.
+        # Pairs beyond max_distance are gated before solving, the check below drops any that are still assigned.
+        rows, cols = get_matching_indices(distance_matrix, self.max_distance)
+        used_rows = np.zeros(distance_matrix.shape[0], dtype=bool)
+        used_cols = np.zeros(distance_matrix.shape[1], dtype=bool)
 
         for row, col in zip(rows, cols):
-            if row in used_rows or col in used_cols:
-                continue
-
             if distance_matrix[row, col] > self.max_distance:
                 continue
 
             object_id = object_ids[row]
             filtered_objects[object_id]['centroid'] = input_centroids[col]
-            filtered_objects[object_id]['centroids'].append(input_centroids[col])
+            append_centroid(filtered_objects[object_id], input_centroids[col])
             self.disappeared[object_id] = 0
-            used_rows.add(row)
-            used_cols.add(col)
+            used_rows[row] = True
+            used_cols[col] = True
 
         self.handle_unmatched_objects(distance_matrix, used_rows, used_cols, object_ids, input_centroids, obj_type)
 
@@ -127,13 +162,13 @@ class CentroidTracker:
         Handle objects that were not matched and register new objects if needed.
 
         :param distance_matrix: Distance matrix between object centroids and input centroids.
-        :param used_rows: Set of used row indices.
-        :param used_cols: Set of used column indices.
+        :param used_rows: Boolean mask of used rows.
+        :param used_cols: Boolean mask of used columns.
         :param object_ids: List of object IDs.
         :param input_centroids: Numpy array of input centroids.
         """
-        unused_rows = set(range(distance_matrix.shape[0])) - used_rows
-        unused_cols = set(range(distance_matrix.shape[1])) - used_cols
+        unused_rows = np.flatnonzero(~used_rows)
+        unused_cols = np.flatnonzero(~used_cols)
 
         if len(unused_rows) >= len(unused_cols):
             for row in unused_rows:
@@ -152,42 +187,59 @@ class CentroidTracker:
         :param obj_type: The type of objects to filter.
         :return: Dictionary of filtered objects.
         """
-        return {object_id: data for object_id, data in self.objects.items() if data['type'] == obj_type}
+        return dict(self.objects_by_type[obj_type])
 
     def correlate_objects(self, angle_offset: float = 45.0,
-                          distance_threshold: float = 80.0) -> List[Tuple[int, float, int, float]]:
+                          distance_threshold: float = 80.0) -> List[Tuple[int, int, int, int]]:
         """
         Correlate detected umbrellas with detected persons based on proximity and vertical angle constraint.
 
         :param angle_offset: Maximum angle offset from the vertical line to consider (for both north and south).
         :param distance_threshold: Maximum distance to consider for correlation.
+        :return: List of (person_id, person_score, umbrella_id, umbrella_score) with scores in 0..SCORE_MAX.
         """
-        persons = self.filter_by_type('person')
-        umbrellas = self.filter_by_type('umbrella')
+        # Read only, correlating never registers or deregisters objects
+        persons = self.objects_by_type['person']
+        umbrellas = self.objects_by_type['umbrella']
+
+        if not persons or not umbrellas:
+            return []
+
+        person_ids = list(persons)
+        umbrella_ids = list(umbrellas)
+        person_centroids = [data['centroid'] for data in persons.values()]
+        umbrella_centroids = [data['centroid'] for data in umbrellas.values()]
+
+        # Pairs within threshold distance and angle, as (person index, umbrella index)
+        if len(persons) * len(umbrellas) <= SMALL_PAIR_COUNT:
+            # Direct scan of the few pairs, skipping the array setup
+            threshold_sq = distance_threshold * distance_threshold
+            matches = [(i, j) for i, p in enumerate(person_centroids) for j, u in enumerate(umbrella_centroids)
+                       if (u[0] - p[0]) ** 2 + (u[1] - p[1]) ** 2 < threshold_sq
+                       and angle_from_vertical(p, u) <= angle_offset]
+        else:
+            # All pairs in one compiled (or vectorized) pass
+            matches = match_pairs(person_centroids, umbrella_centroids, angle_offset, distance_threshold).tolist()
 
         correlations = []
+        matched = set()
+        update = update_scores
+        for i, j in matches:
+            # Increase score if within threshold distance and angle
+            person_id, umbrella_id = person_ids[i], umbrella_ids[j]
+            person_correlations = persons[person_id]['correlations']
+            umbrella_correlations = umbrellas[umbrella_id]['correlations']
+            update(person_correlations, umbrella_correlations, person_id, umbrella_id, SCORE_INCREMENT)
+            correlations.append((person_id, person_correlations[umbrella_id],
+                                 umbrella_id, umbrella_correlations[person_id]))
+            matched.add((person_id, umbrella_id))
+
+        # Decrease score of the other pairs, only pairs with a score left can change
         for person_id, person_data in persons.items():
-            for umbrella_id, umbrella_data in umbrellas.items():
-                distance = np.linalg.norm(np.array(person_data["centroid"]) - np.array(umbrella_data["centroid"]))
-                if distance < distance_threshold:
-                    angle = angle_from_vertical(person_data['centroid'], umbrella_data['centroid'])
-                    if angle <= angle_offset:
-                        # Increase score if within threshold distance and angle
-                        score_increment = 0.02
-                        update_score(person_data, umbrella_id, score_increment)
-                        update_score(umbrella_data, person_id, score_increment)
-
-                        correlations.append((person_id, person_data['correlations'][umbrella_id],
-                                             umbrella_id, umbrella_data['correlations'][person_id]))
-                    else:
-                        # Decrease score if angle is beyond threshold
-                        score_decrement = -0.05
-                        update_score(person_data, umbrella_id, score_decrement)
-                        update_score(umbrella_data, person_id, score_decrement)
-                else:
-                    # Decrease score if distance is beyond threshold
-                    score_decrement = -0.05
-                    update_score(person_data, umbrella_id, score_decrement)
-                    update_score(umbrella_data, person_id, score_decrement)
+            person_correlations = person_data['correlations']
+            for umbrella_id, score in person_correlations.items():
+                if score > 0 and umbrella_id in umbrellas and (person_id, umbrella_id) not in matched:
+                    update(person_correlations, umbrellas[umbrella_id]['correlations'],
+                           person_id, umbrella_id, SCORE_DECREMENT)
 
         return correlations
@@ -0,0 +1,86 @@
+from functools import lru_cache
+import math
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional, the NumPy implementation is used instead
+    njit = None
+
+
+@lru_cache(maxsize=16)
+def _make_scratch(persons, umbrellas):
+    """
+    Preallocate the buffers for a (persons, umbrellas) problem size.
+
+    Scene populations are stable between frames, so the same shapes recur and the buffers are reused.
+
+    :return: Tuple of (diff, distances_sq, angles, matched) ndarrays.
+    """
+    return (np.empty((persons, umbrellas, 2), dtype=np.float32),
+            np.empty((persons, umbrellas), dtype=np.float32),
+            np.empty((persons, umbrellas), dtype=np.float32),
+            np.empty((persons, umbrellas), dtype=np.bool_))
+
+
+def _match_pairs_numpy(person_centroids, umbrella_centroids, angle_offset, distance_threshold):
+    """NumPy implementation of `match_pairs`."""
+    diff, distances_sq, angles, matched = _make_scratch(person_centroids.shape[0], umbrella_centroids.shape[0])
+    np.subtract(umbrella_centroids[None, :, :], person_centroids[:, None, :], out=diff)
+    # Squared distances, compared against the squared threshold so no sqrt is needed
+    np.einsum('ijk,ijk->ij', diff, diff, out=distances_sq)
+
+    # Angle from the vertical line, see `angle_from_vertical`
+    np.arctan2(diff[..., 0], diff[..., 1], out=angles)
+    np.degrees(angles, out=angles)
+    np.abs(angles, out=angles)
+    np.subtract(180, angles, out=angles)
+
+    np.less(distances_sq, distance_threshold * distance_threshold, out=matched)
+    matched &= angles <= angle_offset
+    return np.argwhere(matched)
+
+
+def _match_pairs_loop(person_centroids, umbrella_centroids, angle_offset, distance_threshold):
+    """Scalar loop implementation of `match_pairs`, compiled with numba."""
+    threshold_sq = distance_threshold * distance_threshold
+    pairs = np.empty((person_centroids.shape[0] * umbrella_centroids.shape[0], 2), dtype=np.int64)
+    count = 0
+    for i in range(person_centroids.shape[0]):
+        for j in range(umbrella_centroids.shape[0]):
+            dx = umbrella_centroids[j, 0] - person_centroids[i, 0]
+            dy = umbrella_centroids[j, 1] - person_centroids[i, 1]
+            # Reject on the squared distance before computing the angle
+            if dx * dx + dy * dy >= threshold_sq:
+                continue
+            angle = 180.0 - abs(math.degrees(math.atan2(dx, dy)))
+            if angle <= angle_offset:
+                pairs[count, 0] = i
+                pairs[count, 1] = j
+                count += 1
+    return pairs[:count]
+
+
+if njit is not None:
+    _match_pairs = njit(cache=True, fastmath=True)(_match_pairs_loop)
+else:
+    _match_pairs = _match_pairs_numpy
+
+
+def match_pairs(person_centroids, umbrella_centroids, angle_offset, distance_threshold):
+    """
+    Find the person/umbrella pairs that belong together.
+
+    A pair matches when it is closer than `distance_threshold` and the umbrella is within
+    `angle_offset` degrees of the vertical above the person.
+
+    :param person_centroids: Array of shape (N, 2) with person centroids.
+    :param umbrella_centroids: Array of shape (M, 2) with umbrella centroids.
+    :param angle_offset: Maximum angle offset from the vertical line.
+    :param distance_threshold: Maximum distance between the centroids.
+    :return: Array of shape (K, 2) with the (person index, umbrella index) of each matching pair, in row-major order.
+    """
+    person_centroids = np.asarray(person_centroids, dtype=np.float32).reshape(-1, 2)
+    umbrella_centroids = np.asarray(umbrella_centroids, dtype=np.float32).reshape(-1, 2)
+    return _match_pairs(person_centroids, umbrella_centroids, np.float32(angle_offset),
+                        np.float32(distance_threshold))
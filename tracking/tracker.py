@@ -1,58 +1,95 @@
 import logging
-import datetime
 import numpy as np
 
 log = logging.getLogger(__name__)
 
+# Line crossings keyed by the signs of (direction, y - middle line, x - left line) and the initial position.
+# The value is the change in delta: -1 for an exit, 1 for an enter and 0 for a crossing right of the left line.
+# Every crossing flips the initial position, all other states leave the object untouched.
+CROSSINGS = {
+    (-1, -1, -1, False): -1,
+    (-1, -1, 1, False): 0,
+    (1, 1, -1, True): 1,
+    (1, 1, 1, True): 0,
+}
 
-def log_event(event_type, count, delta, direction, height, centroid, initial_position):
-    date_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log.info(
-        f"{date_time}: {event_type} - count: {count}, delta: {delta}, dir: {direction}, height: {height}, "
-        f"centroid: {centroid}, position: {initial_position}")
+# Boxes of a class without detections, shared read-only by all empty frames
+NO_BOXES = np.empty((0, 4), dtype=np.int32)
+NO_BOXES.flags.writeable = False
+
+
+def log_event(event_type, obj_type, object_id, count, delta, direction, height, centroid, initial_position):
+    # The timestamp comes from the log format, arguments are only formatted when INFO is enabled
+    if not log.isEnabledFor(logging.INFO):
+        return
+    log.info("%s %s %s - count: %s, delta: %s, dir: %s, height: %s, centroid: %s, position: %s",
+             event_type, obj_type, object_id, count, delta, direction, height, centroid, initial_position)
 
 
 def filter_detections(detections, target_class, confidence_threshold=0.4):
-    filtered_detections = [
-        tuple(map(int, det[:4])) for det in detections
-        if int(det[5]) == target_class and det[4] >= confidence_threshold
-    ]
-    return filtered_detections
+    """
+    Select the bounding boxes of one class above a confidence threshold.
+
+    :param detections: Array of shape (N, 6) with rows of (x1, y1, x2, y2, confidence, class).
+    :param target_class: Class ID to keep.
+    :param confidence_threshold: Minimum confidence to keep a detection.
+    :return: Array of shape (K, 4) with the int32 bounding boxes.
+    """
+    return split_detections(detections, (target_class,), confidence_threshold)[0]
+
+
+def split_detections(detections, target_classes, confidence_threshold=0.4):
+    """
+    Select the bounding boxes of several classes above a confidence threshold in one pass.
+
+    :param detections: Array of shape (N, 6) with rows of (x1, y1, x2, y2, confidence, class).
+    :param target_classes: Class IDs to keep.
+    :param confidence_threshold: Minimum confidence to keep a detection.
+    :return: Tuple with an array of shape (K, 4) with the int32 bounding boxes for each target class.
+    """
+    detections = np.asarray(detections).reshape(-1, 6)
+    if len(detections) == 0:
+        # Empty scenes are common, skip the masks and hand every class the same empty array
+        return (NO_BOXES,) * len(target_classes)
+
+    # Confidence filter, class cast and box conversion are shared by all classes
+    confident = detections[:, 4] >= confidence_threshold
+    classes = detections[confident, 5].astype(np.int32)
+    boxes = detections[confident, :4].astype(np.int32)
+    return tuple(boxes[classes == target_class] for target_class in target_classes)
 
 
 def handle_tracked_objects(delta, height, total, total_down, total_up, tracked_objects, coords_left):
     # Convert filtered detections to list of bounding boxes
     # Update tracking with bounding boxes
+    mid_y = height // 2
     for (object_id, data) in tracked_objects.items():
         centroid = data['centroid']
+        cx, cy = centroid
+        init_up = data.get('initialPositionUp')
 
-        if data.get('initialPositionUp') is None:
-            data['initialPositionUp'] = centroid[1] < height // 2
+        if init_up is None:
+            data['initialPositionUp'] = cy < mid_y
         else:
-            y = [c[1] for c in data['centroids']]
-            direction = centroid[1] - np.mean(y)
-            data['centroids'].append(centroid)
-            if len(data['centroids']) > 10:
-                data['centroids'].pop(0)
-
-            if direction < 0 and centroid[0] < coords_left and centroid[1] < height // 2 and not data['initialPositionUp']:
-                total_up += 1
-                delta -= 1
-                log_event(f"EXIT {data['type']} {object_id}", total_up, delta, direction, height,
-                          centroid[1], data['initialPositionUp'])
-                data['initialPositionUp'] = not data['initialPositionUp']
-            elif direction < 0 and centroid[0] > coords_left and centroid[1] < height // 2 and not data['initialPositionUp']:
-                data['initialPositionUp'] = not data['initialPositionUp']
-
-            elif direction > 0 and centroid[0] < coords_left and centroid[1] > height // 2 and data['initialPositionUp']:
-                total_down += 1
-                delta += 1
-                log_event(f"ENTER {data['type']} {object_id}", total_down, delta, direction, height,
-                          centroid[1], data['initialPositionUp'])
-                data['initialPositionUp'] = not data['initialPositionUp']
-
-            elif direction > 0 and centroid[0] > coords_left and centroid[1] > height // 2 and data['initialPositionUp']:
-                data['initialPositionUp'] = not data['initialPositionUp']
+            # The history already holds this frame's centroid, match_objects appended it
+            direction = cy - data['y_sum'] / len(data['centroids'])
+
+            # Signs of the movement and of the position relative to both lines, -1, 0 or 1
+            moving = int(direction > 0) - int(direction < 0)
+            zone = int(cy > mid_y) - int(cy < mid_y)
+            side = int(cx > coords_left) - int(cx < coords_left)
+            crossing = CROSSINGS.get((moving, zone, side, init_up))
+
+            if crossing is not None:
+                if crossing < 0:
+                    total_up += 1
+                    delta -= 1
+                    log_event("EXIT", data['type'], object_id, total_up, delta, direction, height, cy, init_up)
+                elif crossing > 0:
+                    total_down += 1
+                    delta += 1
+                    log_event("ENTER", data['type'], object_id, total_down, delta, direction, height, cy, init_up)
+                data['initialPositionUp'] = not init_up
             total = total_down - total_up
 
     return delta, total, total_down, total_up